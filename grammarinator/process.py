@@ -6,8 +6,6 @@
 # This file may not be copied, modified, or distributed except
 # according to those terms.
 
-import re
-
 from argparse import ArgumentParser
 from os import getcwd
 from os.path import exists
@@ -42,6 +40,8 @@ def execute():
                         help='enable autopep8 to format the generated fuzzer.')
     parser.add_argument('-o', '--out', metavar='DIR', default=getcwd(),
                         help='temporary working directory (default: %(default)s).')
+    parser.add_argument('--template-cache', metavar='DIR',
+                        help='directory to cache the compiled code generator template in to speed up subsequent runs (default: no caching).')
     add_encoding_argument(parser, help='grammar file encoding (default: %(default)s).')
     add_encoding_errors_argument(parser)
     add_log_level_argument(parser, short_alias=())
@@ -54,17 +54,16 @@ def execute():
 
     options = {}
     for option in args.options:
-        parts = re.fullmatch('([^=]+)=(.*)', option)
-        if not parts:
+        name, sep, value = option.partition('=')
+        if not name or not sep:
             parser.error(f'option not in OPT=VAL format: {option}')
 
-        name, value = parts.group(1, 2)
         options[name] = value
 
     init_logging()
     process_log_level_argument(args, logger)
 
-    ProcessorTool(args.language, args.out).process(args.grammar, options=options, default_rule=args.rule, encoding=args.encoding, errors=args.encoding_errors, lib_dir=args.lib, actions=args.actions, pep8=args.pep8)
+    ProcessorTool(args.language, args.out, template_cache_dir=args.template_cache).process(args.grammar, options=options, default_rule=args.rule, encoding=args.encoding, errors=args.encoding_errors, lib_dir=args.lib, actions=args.actions, pep8=args.pep8)
 
 
 if __name__ == '__main__':
@@ -7,6 +7,10 @@
 
 import random
 
+from bisect import bisect
+from itertools import accumulate
+from math import isfinite
+
 from .model import Model
 
 
@@ -21,8 +25,16 @@ class DefaultModel(Model):
 
         Parameters ``node`` and ``idx`` are unused.
         """
-        # assert sum(weights) > 0, 'Sum of weights is zero.'
-        return random.choices(range(len(weights)), weights=weights)[0]
+        # Equivalent to random.choices(range(len(weights)), weights=weights)[0],
+        # consuming the same random numbers, without the overhead of its
+        # generic population and k handling.
+        cum_weights = list(accumulate(weights))
+        total = cum_weights[-1]
+        if total <= 0:
+            raise ValueError('Total of weights must be greater than zero')
+        if not isfinite(total):
+            raise ValueError('Total of weights must be finite')
+        return bisect(cum_weights, random.random() * total, 0, len(cum_weights) - 1)
 
     def quantify(self, node, idx, cnt, start, stop):
         """
@@ -8,6 +8,8 @@
 import itertools
 import logging
 
+from array import array
+
 from .default_model import DefaultModel
 from .rule import RuleSize, UnlexerRule, UnparserRule, UnparserRuleAlternative, UnparserRuleQuantified, UnparserRuleQuantifier
 
@@ -269,4 +271,6 @@ class Generator:
 
     @staticmethod
     def _charset(ranges):
-        return tuple(itertools.chain.from_iterable(range(start, stop) for start, stop in ranges))
+        # Store the codepoints in a compact array instead of a tuple of int
+        # objects, since charsets (e.g., the dot) may span the whole unicode.
+        return array('I', itertools.chain.from_iterable(range(start, stop) for start, stop in ranges))
@@ -59,8 +59,8 @@ class Model:
             field identifies the corresponding grammar rule, which contains the
             charset.
         :param int idx: Index of the charset inside the current rule.
-        :param list[str] chars: List of characters to choose a single character
-            from.
+        :param array.array chars: Codepoints of the characters (as unsigned
+            ints) to choose a single character from.
         :return: The chosen character.
         :rtype: str
         """
@@ -29,14 +29,22 @@ class WeightedModel(Model):
             corresponds to the indices of the ``weights`` parameter.
         """
         self._model = model
-        self._weights = weights or {}
+        # Group the multipliers by alternation, so that a choice needs a single
+        # lookup to find them, and the weights of alternations without
+        # multipliers can be passed on unchanged.
+        self._weights = {}
+        for (name, alternation_idx, alternative_idx), w in (weights or {}).items():
+            self._weights.setdefault((name, alternation_idx), {})[alternative_idx] = w
 
     def choice(self, node, idx, weights):
         """
         Transitively calls the ``choice`` method of the underlying model with
         multipliers applied to ``weights`` first.
         """
-        return self._model.choice(node, idx, [w * self._weights.get((node.name, idx, i), 1) for i, w in enumerate(weights)])
+        alternation_weights = self._weights.get((node.name, idx))
+        if alternation_weights is not None:
+            weights = [w * alternation_weights.get(i, 1) for i, w in enumerate(weights)]
+        return self._model.choice(node, idx, weights)
 
     def quantify(self, node, idx, cnt, start, stop):
         """
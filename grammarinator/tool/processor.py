@@ -8,12 +8,13 @@
 
 import logging
 
-from collections import Counter, defaultdict, OrderedDict
-from itertools import chain
+from bisect import bisect_right
+from collections import Counter, deque
+from functools import lru_cache
+from itertools import islice
 from math import inf
-from os import getcwd
+from os import getcwd, makedirs, remove, replace
 from os.path import dirname, exists, join
-from pkgutil import get_data
 from shutil import copy
 from sys import maxunicode
 
@@ -21,7 +22,7 @@ import autopep8
 import regex as re
 
 from antlr4 import CommonTokenStream, FileStream, ParserRuleContext
-from jinja2 import Environment
+from jinja2 import Environment, FileSystemBytecodeCache, PackageLoader
 
 from ..pkgdata import __version__
 from .g4 import ANTLRv4Lexer, ANTLRv4Parser
@@ -31,6 +32,8 @@ logger = logging.getLogger(__name__)
 
 class Edge:
 
+    __slots__ = ('dst', 'args', 'reserve')
+
     def __init__(self, dst, args=None):
         self.dst = dst
         self.args = args
@@ -39,6 +42,8 @@ class Edge:
 
 class Node:
 
+    __slots__ = ('id', 'out_edges')
+
     _cnt = 0
 
     def __init__(self, id=None):
@@ -74,6 +79,9 @@ class Node:
 
 
 class NodeSize:
+
+    __slots__ = ('depth', 'tokens')
+
     def __init__(self, depth, tokens):
         self.depth = depth
         self.tokens = tokens
@@ -87,6 +95,8 @@ class NodeSize:
 
 class RuleNode(Node):
 
+    __slots__ = ('name', 'type', 'trampoline', 'min_size', 'labels', 'args', 'locals', 'returns', 'init', 'after')
+
     def __init__(self, name, type, trampoline=False):
         name = name if isinstance(name, tuple) else (name,)
         super().__init__(name)
@@ -109,6 +119,8 @@ class RuleNode(Node):
 
 class UnlexerRuleNode(RuleNode):
 
+    __slots__ = ('start_ranges',)
+
     _lit_cnt = 0
 
     def __init__(self, name=None):
@@ -121,18 +133,24 @@ class UnlexerRuleNode(RuleNode):
 
 class UnparserRuleNode(RuleNode):
 
+    __slots__ = ()
+
     def __init__(self, name, trampoline=False):
         super().__init__(name, 'UnparserRule', trampoline)
 
 
 class ImagRuleNode(Node):
 
+    __slots__ = ()
+
     def __init__(self, id):
         super().__init__(id)
 
 
 class LiteralNode(Node):
 
+    __slots__ = ('src',)
+
     def __init__(self, src):
         super().__init__()
         self.src = src
@@ -143,6 +161,8 @@ class LiteralNode(Node):
 
 class CharsetNode(Node):
 
+    __slots__ = ('rule_id', 'idx', 'charset')
+
     def __init__(self, rule_id, idx, charset):
         super().__init__()
         self.rule_id = rule_id  # Identifier of the container rule.
@@ -155,12 +175,16 @@ class CharsetNode(Node):
 
 class LambdaNode(Node):
 
+    __slots__ = ()
+
     def __init__(self):
         super().__init__()
 
 
 class AlternationNode(Node):
 
+    __slots__ = ('rule_id', 'idx', 'conditions', 'min_sizes')
+
     def __init__(self, rule_id, idx, conditions):
         super().__init__((rule_id, 'alt', idx))
         self.rule_id = rule_id  # Identifier of the container rule.
@@ -202,6 +226,8 @@ class AlternationNode(Node):
 
 class AlternativeNode(Node):
 
+    __slots__ = ('rule_id', 'alt_idx', 'idx')
+
     def __init__(self, rule_id, alt_idx, idx):
         super().__init__((rule_id, 'alt', alt_idx, idx))
         self.rule_id = rule_id  # Identifier of the container rule.
@@ -218,6 +244,8 @@ class AlternativeNode(Node):
 
 class QuantifierNode(Node):
 
+    __slots__ = ('rule_id', 'idx', 'start', 'stop', 'min_size')
+
     def __init__(self, rule_id, idx, start, stop):
         super().__init__((rule_id, 'quant', idx))
         self.rule_id = rule_id  # Identifier of the container rule.
@@ -232,6 +260,8 @@ class QuantifierNode(Node):
 
 class ActionNode(Node):
 
+    __slots__ = ('src',)
+
     def __init__(self, src):
         super().__init__()
         self.src = src
@@ -242,6 +272,8 @@ class ActionNode(Node):
 
 class VariableNode(Node):
 
+    __slots__ = ('name', 'is_list')
+
     def __init__(self, name, is_list):
         super().__init__()
         self.name = name
@@ -251,7 +283,10 @@ class VariableNode(Node):
         return f'{super().__str__()}; name: {self.name}; list: {self.is_list}'
 
 
+@lru_cache(maxsize=None)
 def printable_ranges(lower_bound, upper_bound):
+    # Cached, since scanning the whole unicode takes long. The ranges are
+    # returned as a tuple, so that callers cannot alter the cached result.
     ranges = []
     range_start = None
     for c in range(lower_bound, upper_bound):
@@ -265,24 +300,48 @@ def printable_ranges(lower_bound, upper_bound):
 
     if range_start is not None:
         ranges.append((range_start, upper_bound))
-    return ranges
+    return tuple(ranges)
 
 
 def multirange_diff(r1_list, r2_list):
-    def range_diff(r1, r2):
-        s1, e1 = r1
-        s2, e2 = r2
-        endpoints = sorted((s1, s2, e1, e2))
-        result = []
-        if endpoints[0] == s1 and endpoints[0] != endpoints[1]:
-            result.append((endpoints[0], endpoints[1]))
-        if endpoints[3] == e1 and endpoints[2] != endpoints[3]:
-            result.append((endpoints[2], endpoints[3]))
-        return result
-
-    for r2 in r2_list:
-        r1_list = list(chain.from_iterable(range_diff(r1, r2) for r1 in r1_list))
-    return r1_list
+    # Subtract the sorted and coalesced r2 ranges from every r1 range in a
+    # single sweep. Only those r2 ranges are visited that overlap with the
+    # current r1 range, the first of which is found by binary search.
+    r2_list = merge_ranges(r2_list)
+    r2_ends = [e2 for _, e2 in r2_list]
+    result = []
+    for s1, e1 in r1_list:
+        start = s1
+        for s2, e2 in islice(r2_list, bisect_right(r2_ends, s1), None):
+            if s2 >= e1:
+                break
+            if s2 > start:
+                result.append((start, s2))
+            start = max(start, e2)
+        if start < e1:
+            result.append((start, e1))
+    return result
+
+
+def merge_ranges(ranges):
+    # Sort the (half-open) ranges by their start and coalesce the overlapping
+    # or adjacent ones in a single pass.
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            if end > merged[-1][1]:
+                merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+    return merged
+
+
+@lru_cache(maxsize=None)
+def unicode_chars():
+    # All the characters that unicode property escapes are matched against,
+    # indexed by their codepoint. Built on first use only, since it is large,
+    # and cached only while a graph is built (see build_graph).
+    return ''.join(map(chr, range(maxunicode)))
 
 
 def append_unique(container, element):
@@ -293,10 +352,33 @@ def append_unique(container, element):
     return len(container) - 1
 
 
+# The ranges are computed on demand only (and at most once per process), since
+# scanning the whole unicode for printable characters is costly and most
+# grammars do not need it.
 dot_ranges = {
-    'any_ascii_letter': [(ord('A'), ord('Z') + 1), (ord('a'), ord('z') + 1)],
-    'any_ascii_char': printable_ranges(0x00, 0x80),
-    'any_unicode_char': printable_ranges(0, maxunicode + 1),
+    'any_ascii_letter': lambda: [(ord('A'), ord('Z') + 1), (ord('a'), ord('z') + 1)],
+    'any_ascii_char': lambda: printable_ranges(0x00, 0x80),
+    'any_unicode_char': lambda: printable_ranges(0, maxunicode + 1),
+}
+
+quant_ranges = {
+    '?': {'start': 0, 'stop': 1},
+    '*': {'start': 0, 'stop': 'inf'},
+    '+': {'start': 1, 'stop': 'inf'},
+}
+
+# To be kept in sync with org.antlr.v4.misc.CharSupport.ANTLRLiteralEscapedCharValue
+escaped_codepoints = {
+    'n': ord('\n'),
+    'r': ord('\r'),
+    'b': ord('\b'),
+    't': ord('\t'),
+    'f': ord('\f'),
+    '\\': ord('\\'),
+    # Additional escape sequences defined by org.antlr.v4.misc.EscapeSequenceParsing.parseEscape
+    '-': ord('-'),
+    ']': ord(']'),
+    '\'': ord('\''),
 }
 
 
@@ -304,7 +386,12 @@ class GrammarGraph:
 
     def __init__(self):
         self.name = None
-        self.vertices = OrderedDict()
+        self.vertices = {}
+        # Vertices of the kinds that are looked up repeatedly, grouped by
+        # group_vertices once the graph is built.
+        self._rule_vertices = {}
+        self._imag_rule_vertices = {}
+        self._alternation_vertices = {}
         self.options = {}
         self.charsets = []
         self.alt_conds = []
@@ -325,11 +412,11 @@ class GrammarGraph:
 
     @property
     def rules(self):
-        return (vertex for vertex in self.vertices.values() if isinstance(vertex, RuleNode))
+        return iter(self._rule_vertices.values())
 
     @property
     def imag_rules(self):
-        return (vertex for vertex in self.vertices.values() if isinstance(vertex, ImagRuleNode))
+        return iter(self._imag_rule_vertices.values())
 
     def print_tree(self, root=None):
         if not root and not self.default_rule:
@@ -343,35 +430,76 @@ class GrammarGraph:
     def add_edge(self, frm, to, args=None):
         frm = frm if isinstance(frm, tuple) else (frm,)
         to = to if isinstance(to, tuple) else (to,)
-        assert frm in self.vertices, f'{frm} not in vertices.'
-        assert to in self.vertices, f'{to} not in vertices.'
-        self.vertices[frm].out_edges.append(Edge(dst=self.vertices[to], args=args))
+        frm_node, to_node = self.vertices.get(frm), self.vertices.get(to)
+        assert frm_node is not None, f'{frm} not in vertices.'
+        assert to_node is not None, f'{to} not in vertices.'
+        frm_node.out_edges.append(Edge(dst=to_node, args=args))
+
+    def group_vertices(self):
+        # Group the vertices of the kinds that are looked up repeatedly (in
+        # insertion order) to spare filtering all the vertices every time. The
+        # groups are built from the final vertices, so this must be called once
+        # the graph is complete.
+        self._rule_vertices, self._imag_rule_vertices, self._alternation_vertices = {}, {}, {}
+        for ident, node in self.vertices.items():
+            if isinstance(node, RuleNode):
+                self._rule_vertices[ident] = node
+            elif isinstance(node, ImagRuleNode):
+                self._imag_rule_vertices[ident] = node
+            elif isinstance(node, AlternationNode):
+                self._alternation_vertices[ident] = node
 
     def calc_min_sizes(self):
-        min_sizes = defaultdict(lambda: NodeSize(depth=inf, tokens=inf))
+        min_sizes = {ident: NodeSize(depth=inf, tokens=inf) for ident in self.vertices}
+
+        # Resolve the size entries of the children that contribute to the size
+        # of each vertex (i.e., all but the optional quantifiers) once, together
+        # with the depth and token increments they add. Also collect the
+        # incoming neighbours of the vertices, since those are the ones
+        # affected if the size of a vertex decreases.
+        children = {}
+        in_neighbours = {ident: [] for ident in self.vertices}
+        for ident, node in self.vertices.items():
+            children[ident] = []
+            for out_node in node.out_neighbours:
+                if isinstance(out_node, QuantifierNode) and out_node.start == 0:
+                    continue
+                children[ident].append((min_sizes[out_node.id], int(isinstance(out_node, RuleNode)), int(isinstance(out_node, UnlexerRuleNode))))
+                in_neighbours[out_node.id].append(ident)
+
+        # Calculcate the size metrics for all the subtrees. Every vertex is
+        # examined at least once (starting from the latest added ones, which
+        # tend to be closer to the leaves), and later re-examined only if the
+        # size of any of its contributing children has decreased.
+        alternations = self._alternation_vertices
+        work_list = deque(reversed(self.vertices))
+        in_work_list = set(work_list)
+        while work_list:
+            ident = work_list.popleft()
+            in_work_list.remove(ident)
+            children_sizes = children[ident]
+            min_size = min_sizes[ident]
+
+            if ident in alternations:
+                depth = min((c.depth + d for c, d, _ in children_sizes), default=0)
+                tokens = min((c.tokens + t for c, _, t in children_sizes), default=0)
+            else:
+                depth = max((c.depth + d for c, d, _ in children_sizes), default=0)
+                tokens = sum(c.tokens + t for c, _, t in children_sizes)
 
-        # Calculcate the size metrics for all the subtrees.
-        changed = True
-        while changed:
             changed = False
-            for ident, node in self.vertices.items():
-                children_sizes = [NodeSize(depth=min_sizes[out_node.id].depth + int(isinstance(out_node, RuleNode)),
-                                           tokens=min_sizes[out_node.id].tokens + int(isinstance(out_node, UnlexerRuleNode)))
-                                  for out_node in node.out_neighbours if not isinstance(out_node, QuantifierNode) or out_node.start > 0]
-
-                if isinstance(node, AlternationNode):
-                    min_size = NodeSize(depth=min((c.depth for c in children_sizes), default=0),
-                                        tokens=min((c.tokens for c in children_sizes), default=0))
-                else:
-                    min_size = NodeSize(depth=max((c.depth for c in children_sizes), default=0),
-                                        tokens=sum(c.tokens for c in children_sizes))
-
-                if min_size.depth < min_sizes[ident].depth:
-                    min_sizes[ident].depth = min_size.depth
-                    changed = True
-                if min_size.tokens < min_sizes[ident].tokens:
-                    min_sizes[ident].tokens = min_size.tokens
-                    changed = True
+            if depth < min_size.depth:
+                min_size.depth = depth
+                changed = True
+            if tokens < min_size.tokens:
+                min_size.tokens = tokens
+                changed = True
+
+            if changed:
+                for in_ident in in_neighbours[ident]:
+                    if in_ident not in in_work_list:
+                        work_list.append(in_ident)
+                        in_work_list.add(in_ident)
 
         # Assign the calculated size metric values to the vertices participating in generator decisions.
         for ident, node in self.vertices.items():
@@ -397,12 +525,25 @@ class GrammarGraph:
         immutables = set()
         while changed:
             changed = False
-            for vertex in self.vertices.values():
-                if isinstance(vertex, RuleNode) and all(isinstance(vout, LiteralNode) or vout.id in immutables for vout in vertex.out_neighbours):
+            for vertex in self._rule_vertices.values():
+                if all(isinstance(vout, LiteralNode) or vout.id in immutables for vout in vertex.out_neighbours):
                     if vertex.id not in immutables:
                         immutables.add(vertex.id)
                         changed = True
-        self.immutables = sorted(immutables)
+        self.immutables = immutables
+
+
+@lru_cache(maxsize=None)
+def compile_pattern(pattern):
+    return re.compile(pattern)
+
+
+def substitute(s, frm, to):
+    # The patterns come from the template, so there are only a few of them.
+    # They are compiled once, as the module-level functions of regex spend
+    # several times longer on looking up their pattern cache than on the
+    # substitution itself.
+    return compile_pattern(frm).sub(to, str(s))
 
 
 def escape_string(s):
@@ -437,24 +578,38 @@ def escape_string(s):
     return ''.join(c for c in _iter_escaped_chars(s))
 
 
+@lru_cache(maxsize=None)
+def generator_template(lang, cache_dir=None):
+    # The template is loaded once per language in a process. If a cache
+    # directory is given, the compiled template is also cached on disk to spare
+    # its compilation in subsequent invocations.
+    if cache_dir is not None:
+        makedirs(cache_dir, exist_ok=True)
+    env = Environment(loader=PackageLoader(__package__, 'resources/codegen'),
+                      bytecode_cache=FileSystemBytecodeCache(cache_dir) if cache_dir is not None else None,
+                      trim_blocks=True,
+                      lstrip_blocks=True,
+                      keep_trailing_newline=False)
+    env.filters['substitute'] = substitute
+    env.filters['escape_string'] = escape_string
+    return env.get_template('GeneratorTemplate.' + lang + '.jinja')
+
+
 class ProcessorTool:
     """
     Tool to process ANTLRv4 grammar files, build an internal representation
     from them and create a generator class that is able to produce textual data
     according to the grammar files.
     """
-    def __init__(self, lang, work_dir=None):
+    def __init__(self, lang, work_dir=None, template_cache_dir=None):
         """
         :param str lang: Language of the generated code (currently, only ``'py'`` is accepted as Python is the only supported language).
         :param str work_dir: Directory to generate fuzzers into (default: the current working directory).
+        :param str template_cache_dir: Directory to cache the compiled code generator template in, to speed up subsequent
+               invocations (default: no caching).
         """
         self._lang = lang
-        env = Environment(trim_blocks=True,
-                          lstrip_blocks=True,
-                          keep_trailing_newline=False)
-        env.filters['substitute'] = lambda s, frm, to: re.sub(frm, to, str(s))
-        env.filters['escape_string'] = escape_string
-        self._template = env.from_string(get_data(__package__, 'resources/codegen/GeneratorTemplate.' + lang + '.jinja').decode('utf-8'))
+        self._template = generator_template(lang, template_cache_dir)
         self._work_dir = work_dir or getcwd()
 
     def process(self, grammars, *, options=None, default_rule=None, encoding='utf-8', errors='strict', lib_dir=None, actions=True, pep8=False):
@@ -492,11 +647,31 @@ class ProcessorTool:
         graph = ProcessorTool.build_graph(actions, lexer_root, parser_root, options, default_rule)
         ProcessorTool._analyze_graph(graph)
 
-        src = self._template.render(graph=graph, version=__version__).lstrip()
-        with open(join(self._work_dir, graph.name + '.' + self._lang), 'w') as f:
-            if pep8:
-                src = autopep8.fix_code(src)
-            f.write(src)
+        chunks = self._template.generate(graph=graph, version=__version__)
+        # The source is rendered into a temporary file first, which replaces the
+        # fuzzer only on success, so that a rendering error does not leave a
+        # truncated fuzzer behind.
+        fn = join(self._work_dir, graph.name + '.' + self._lang)
+        tmp_fn = fn + '.tmp'
+        try:
+            with open(tmp_fn, 'w') as f:
+                if pep8:
+                    # Line length fixes (E501) are skipped: reflowing the long lines of the
+                    # generated tables dominates the runtime of autopep8 on large fuzzers.
+                    f.write(autopep8.fix_code(''.join(chunks).lstrip(), options={'ignore': autopep8.DEFAULT_IGNORE.split(',') + ['E501']}))
+                else:
+                    # Stream the rendered source to the file without its leading whitespace.
+                    for chunk in chunks:
+                        chunk = chunk.lstrip()
+                        if chunk:
+                            f.write(chunk)
+                            break
+                    f.writelines(chunks)
+            replace(tmp_fn, fn)
+        except BaseException:
+            if exists(tmp_fn):
+                remove(tmp_fn)
+            raise
 
     @staticmethod
     def parse_grammars(grammars, work_dir, encoding='utf-8', errors='strict', lib_dir=None):
@@ -517,11 +692,17 @@ class ProcessorTool:
 
     @staticmethod
     def _parse_grammar(grammar, encoding, errors, lib_dir):
-        work_list = {grammar}
+        work_list = [grammar]
+        seen = set()
         root = None
 
         while work_list:
             grammar = work_list.pop()
+            # A grammar may be imported by multiple grammars, but its rules
+            # must be united with the host grammar only once.
+            if grammar in seen:
+                continue
+            seen.add(grammar)
 
             antlr_parser = ANTLRv4Parser(CommonTokenStream(ANTLRv4Lexer(FileStream(grammar, encoding=encoding, errors=errors))))
             current_root = antlr_parser.grammarSpec()
@@ -532,10 +713,11 @@ class ProcessorTool:
                 root = current_root
             else:
                 # Unite the rules of the imported grammar with the host grammar's rules.
+                root_rules = root.rules()
                 for rule in current_root.rules().ruleSpec():
-                    root.rules().addChild(rule)
+                    root_rules.addChild(rule)
 
-            work_list |= ProcessorTool._collect_imports(current_root, dirname(grammar), lib_dir)
+            work_list.extend(imp for imp in ProcessorTool._collect_imports(current_root, dirname(grammar), lib_dir) if imp not in seen)
 
         return root
 
@@ -560,32 +742,37 @@ class ProcessorTool:
             if not actions:
                 return '1'
 
-            if isinstance(node, str):
-                return node
+            # The condition of an alternative is the semantic predicate at its
+            # first element, if any. Labeled parser alternatives and lexer
+            # alternatives wrap the sequence of elements in an extra context.
+            if isinstance(node, ANTLRv4Parser.LabeledAltContext):
+                node = node.alternative()
+            elif isinstance(node, ANTLRv4Parser.LexerAltContext):
+                node = node.lexerElements()
+
+            # Only the first element is needed, hence the full list of elements
+            # is not built.
+            if isinstance(node, ANTLRv4Parser.AlternativeContext):
+                element = node.element(0)
+            elif isinstance(node, ANTLRv4Parser.LexerElementsContext):
+                element = node.lexerElement(0)
+            else:
+                element = None
 
-            action_block = getattr(node, 'actionBlock', None)
-            if action_block:
-                if action_block() and action_block().ACTION_CONTENT() and node.QUESTION():
-                    return ''.join(str(child) for child in action_block().ACTION_CONTENT())
+            # An alternative can be explicitly empty, in this case it has no elements.
+            if not element:
                 return '1'
 
-            element = getattr(node, 'element', None) or getattr(node, 'lexerElement', None)
-            if element:
-                if not element():
-                    return '1'
-                return find_conditions(element(0))
-
-            child_ref = getattr(node, 'alternative', None) or getattr(node, 'lexerElements', None)
-
-            # An alternative can be explicitly empty, in this case it won't have any of the attributes above.
-            if not child_ref:
+            action_block = element.actionBlock()
+            if not action_block or not element.QUESTION():
                 return '1'
-
-            return find_conditions(child_ref())
+            action_content = action_block.ACTION_CONTENT()
+            return ''.join(str(child) for child in action_content) if action_content else '1'
 
         def character_range_interval(node):
-            start = str(node.characterRange().STRING_LITERAL(0))[1:-1]
-            end = str(node.characterRange().STRING_LITERAL(1))[1:-1]
+            char_range = node.characterRange()
+            start = str(char_range.STRING_LITERAL(0))[1:-1]
+            end = str(char_range.STRING_LITERAL(1))[1:-1]
             start_cp, start_offset = process_lexer_char(start, 0, 'character range')
             end_cp, end_offset = process_lexer_char(end, 0, 'character range')
 
@@ -657,11 +844,13 @@ class ProcessorTool:
                 offset = prop_end_offset + 1  # Skip over last bracket
 
                 def _name_to_codepoints(uni_prop):
+                    # Match the runs of the property in a single scan instead of
+                    # testing every codepoint separately.
                     try:
-                        pattern = re.compile(uni_prop)
+                        pattern = re.compile(f'(?:{uni_prop})+')
                     except Exception as e:
                         raise ValueError(f'Unknown property: {uni_prop}') from e
-                    return [cp for cp in range(maxunicode) if pattern.match(chr(cp))]
+                    return [cp for match in pattern.finditer(unicode_chars()) for cp in range(*match.span())]
 
                 # Collect continous ranges.
                 def _codepoints_to_ranges(codepoints):
@@ -715,22 +904,9 @@ class ProcessorTool:
                 # \p{...} and \P{...} are both handled by the regex lib in case of the supported properties.
                 return _codepoints_to_ranges(_name_to_codepoints(f'\\{escaped}{{{prop_name}}}')), offset
 
-            # To be kept in sync with org.antlr.v4.misc.CharSupport.ANTLRLiteralEscapedCharValue
-            escaped_values = {
-                'n': '\n',
-                'r': '\r',
-                'b': '\b',
-                't': '\t',
-                'f': '\f',
-                '\\': '\\',
-                # Additional escape sequences defined by org.antlr.v4.misc.EscapeSequenceParsing.parseEscape
-                '-': '-',
-                ']': ']',
-                '\'': '\''
-            }
-
-            if escaped in escaped_values:
-                return ord(escaped_values[escaped]), offset
+            codepoint = escaped_codepoints.get(escaped)
+            if codepoint is not None:
+                return codepoint, offset
 
             raise ValueError('Invalid escaped value')
 
@@ -773,8 +949,9 @@ class ProcessorTool:
                     raise ValueError(f'Zero or multi-character literals are not allowed in lexer sets: {char!r}')
                 return [(char_cp, char_cp + 1)]
 
-            if node.TOKEN_REF():
-                src = str(node.TOKEN_REF())
+            token_ref = node.TOKEN_REF()
+            if token_ref:
+                src = str(token_ref)
                 assert graph.vertices[src].start_ranges is not None, f'{src} has no character start ranges.'
                 return graph.vertices[src].start_ranges
 
@@ -787,16 +964,36 @@ class ProcessorTool:
                 if end <= start:
                     raise ValueError(f"Charset range must not be empty: '\\u{{{start:x}}}'..'\\u{{{end - 1:x}}}', '{chr(start)}'..'{chr(end - 1)}'")
 
-            return append_unique(graph.charsets, ranges)
+            # Identical charsets share a single entry, looked up by their content.
+            ranges = merge_ranges(ranges)
+            key = tuple(ranges)
+            charset = charset_lookup.get(key)
+            if charset is None:
+                charset = charset_lookup[key] = len(graph.charsets)
+                graph.charsets.append(ranges)
+            return charset
+
+        def unique_literal(src):
+            # Identical literals share a single vertex, looked up by their content.
+            lit_id = literal_nodes.get(src)
+            if lit_id is None:
+                lit_id = literal_nodes[src] = graph.add_node(LiteralNode(src=src))
+            return lit_id
 
         def unescape_string(s):
-            def _iter_unescaped_chars(s):
-                offset = 0
-                while offset < len(s):
-                    codepoint, offset = process_lexer_char(s, offset, 'string literal')
-                    yield chr(codepoint)
+            # Copy the runs of unescaped characters in bulk and decode only the
+            # escape sequences character by character.
+            chunks = []
+            offset = 0
+            while True:
+                escape_offset = s.find('\\', offset)
+                if escape_offset == -1:
+                    chunks.append(s[offset:])
+                    return ''.join(chunks)
 
-            return ''.join(c for c in _iter_unescaped_chars(s))
+                chunks.append(s[offset:escape_offset])
+                codepoint, offset = process_lexer_char(s, escape_offset, 'string literal')
+                chunks.append(chr(codepoint))
 
         def parse_arg_action_block(node, use_case):
             args = []
@@ -873,211 +1070,241 @@ class ProcessorTool:
             except ValueError:
                 return False
 
-        def build_rule(rule, node):
+        def build_parser_rule_spec(rule, node, parent_id):
+            if actions:
+                rule.args = parse_arg_action_block(node, 'args')
+                rule.locals = parse_arg_action_block(node.localsSpec(), 'locals')
+                rule.returns = parse_arg_action_block(node.ruleReturns(), 'returns')
+
+                for prequel in node.rulePrequel() or []:
+                    rule_action = prequel.ruleAction()
+                    if rule_action:
+                        action_ident = rule_action.identifier()
+                        action_name = str(action_ident.TOKEN_REF() or action_ident.RULE_REF())
+                        if action_name not in ['init', 'after']:
+                            continue
+
+                        src = ''.join(str(child) for child in rule_action.actionBlock().ACTION_CONTENT()).strip()
+                        if action_name == 'init':
+                            rule.init = src
+                        elif action_name == 'after':
+                            rule.after = src
+            build_expr(rule, node.ruleBlock(), parent_id)
+
+        def build_alt_list(rule, node, parent_id):
+            children = [child for child in node.children if isinstance(child, ParserRuleContext)]
+            if len(children) == 1:
+                build_expr(rule, children[0], parent_id)
+                return
+
+            conditions = [find_conditions(child) for child in children]
+            labels = [str(ident.TOKEN_REF() or ident.RULE_REF()) for ident in (child.identifier() for child in children) if ident] if isinstance(node, ANTLRv4Parser.RuleAltListContext) else []
+            # Ensure to start labels with capital letter, since ANTLR will also create a context with capital start character.
+            # It's important to keep them in sync since grammarinator-parse will use this graph for comparison.
+            labels = [label[0].upper() + label[1:] for label in labels]
+            recurring_labels = {name for name, cnt in Counter(labels).items() if cnt > 1}
+            assert len(labels) == 0 or len(labels) == len(children)
+            alt_id = graph.add_node(AlternationNode(idx=alt_idx[rule.name], conditions=append_unique(graph.alt_conds, conditions) if all(isfloat(cond) for cond in conditions) else conditions, rule_id=rule.id))
+            alt_idx[rule.name] += 1
+            graph.add_edge(frm=parent_id, to=alt_id)
+
+            for i, child in enumerate(children):
+                alternative_id = graph.add_node(AlternativeNode(rule_id=rule.id, alt_idx=graph.vertices[alt_id].idx, idx=i))
+                graph.add_edge(frm=alt_id, to=alternative_id)
+
+                if labels:
+                    # Add label index to rules to distinguish the alternatives with recurring labels.
+                    label_idx = labels[:i + 1].count(labels[i]) - 1 if labels[i] in recurring_labels else None
+                    rule_node_id = graph.add_node(UnparserRuleNode(name=(rule.name, labels[i], label_idx) if label_idx is not None else (rule.name, labels[i])))
+                    graph.add_edge(frm=alternative_id, to=rule_node_id)
+                    build_rule(graph.vertices[rule_node_id], child)
+                else:
+                    build_expr(rule, child, alternative_id)
+
+            # Add an artificial rule named `{rule.name}_{label}` that has a single alternation with
+            # the original number of alternatives which are however masked to enable to choose only
+            # those labeled with `label`. This method will be used to regenerate the subtrees produced
+            # by a labelled alternative with recurring label name.
+            for label in recurring_labels:
+                # Mask conditions to enable only the alternatives with the common label.
+                new_conditions = [cond if labels[ci] == label else '0' for ci, cond in enumerate(conditions)]
+                recurring_rule_id = graph.add_node(UnparserRuleNode(name=(rule.name, label), trampoline=True))
+                labeled_alt_id = graph.add_node(AlternationNode(idx=0,
+                                                                conditions=append_unique(graph.alt_conds, new_conditions) if all(isfloat(cond) for cond in new_conditions) else new_conditions,
+                                                                rule_id=recurring_rule_id))
+                graph.add_edge(frm=recurring_rule_id, to=labeled_alt_id)
+                recurring_idx = 0
+                for i in range(len(children)):
+                    labeled_alternative_id = graph.add_node(AlternativeNode(rule_id=recurring_rule_id, alt_idx=0, idx=i))
+                    graph.add_edge(frm=labeled_alt_id, to=labeled_alternative_id)
+                    if labels[i] == label:
+                        graph.add_edge(frm=labeled_alternative_id, to=(rule.name, label, recurring_idx))
+                        recurring_idx += 1
+                    else:
+                        graph.add_edge(frm=labeled_alternative_id, to=lambda_id)
+
+        def build_alternative(rule, node, parent_id):
+            children = node.element() if isinstance(node, ANTLRv4Parser.AlternativeContext) else node.lexerElements().lexerElement()
+            for child in children:
+                build_expr(rule, child, parent_id)
+
+            if not graph.vertices[parent_id].out_neighbours:
+                graph.add_edge(frm=parent_id, to=lambda_id)
+
+        def build_element(rule, node, parent_id):
+            action_block = node.actionBlock()
+            if action_block:
+                # Conditions are handled at alternative processing.
+                if not actions or node.QUESTION():
+                    return
+
+                graph.add_edge(frm=parent_id, to=graph.add_node(ActionNode(src=''.join(str(child) for child in action_block.ACTION_CONTENT()))))
+                return
+
+            suffix = node.ebnfSuffix()
+            if not suffix and hasattr(node, 'ebnf'):
+                ebnf = node.ebnf()
+                block_suffix = ebnf.blockSuffix() if ebnf else None
+                if block_suffix:
+                    suffix = block_suffix.ebnfSuffix()
+
+            if not suffix:
+                build_expr(rule, node.children[0], parent_id)
+                return
+
+            suffix = str(suffix.children[0])
+            quant_id = graph.add_node(QuantifierNode(rule_id=rule.id, idx=quant_idx[rule.name], **quant_ranges[suffix]))
+            quant_idx[rule.name] += 1
+            graph.add_edge(frm=parent_id, to=quant_id)
+            build_expr(rule, node.children[0], quant_id)
+
+        def build_labeled_element(rule, node, parent_id):
+            build_expr(rule, node.atom() or node.block(), parent_id)
+            # Do not save variables if actions are not allowed.
+            if not actions:
+                return
+
+            ident = node.identifier()
+            name = str(ident.RULE_REF() or ident.TOKEN_REF())
+            is_list = node.PLUS_ASSIGN() is not None
+            graph.add_edge(frm=parent_id, to=graph.add_node(VariableNode(name=name, is_list=is_list)))
+            rule.labels[name] = is_list
+
+        def build_ruleref(rule, node, parent_id):  # pylint: disable=unused-argument
+            graph.add_edge(frm=parent_id, to=str(node.RULE_REF()), args=parse_arg_action_block(node, 'call') if actions else None)
+
+        def build_atom(rule, node, parent_id):
             lexer_rule = isinstance(rule, UnlexerRuleNode)
+            lexer_atom = isinstance(node, ANTLRv4Parser.LexerAtomContext)
+            not_set = node.notSet()
 
-            def build_expr(node, parent_id):
-                if isinstance(node, ANTLRv4Parser.ParserRuleSpecContext):
-                    if actions:
-                        rule.args = parse_arg_action_block(node, 'args')
-                        rule.locals = parse_arg_action_block(node.localsSpec(), 'locals')
-                        rule.returns = parse_arg_action_block(node.ruleReturns(), 'returns')
-
-                        for prequel in node.rulePrequel() or []:
-                            rule_action = prequel.ruleAction()
-                            if rule_action:
-                                action_name = str(rule_action.identifier().TOKEN_REF() or rule_action.identifier().RULE_REF())
-                                if action_name not in ['init', 'after']:
-                                    continue
-
-                                src = ''.join(str(child) for child in rule_action.actionBlock().ACTION_CONTENT()).strip()
-                                if action_name == 'init':
-                                    rule.init = src
-                                elif action_name == 'after':
-                                    rule.after = src
-                    build_expr(node.ruleBlock(), parent_id)
-
-                elif isinstance(node, (ANTLRv4Parser.RuleAltListContext, ANTLRv4Parser.AltListContext, ANTLRv4Parser.LexerAltListContext)):
-                    children = [child for child in node.children if isinstance(child, ParserRuleContext)]
-                    if len(children) == 1:
-                        build_expr(children[0], parent_id)
-                        return
-
-                    conditions = [find_conditions(child) for child in children]
-                    labels = [str(child.identifier().TOKEN_REF() or child.identifier().RULE_REF()) for child in children if child.identifier()] if isinstance(node, ANTLRv4Parser.RuleAltListContext) else []
-                    # Ensure to start labels with capital letter, since ANTLR will also create a context with capital start character.
-                    # It's important to keep them in sync since grammarinator-parse will use this graph for comparison.
-                    labels = [label[0].upper() + label[1:] for label in labels]
-                    recurring_labels = {name for name, cnt in Counter(labels).items() if cnt > 1}
-                    assert len(labels) == 0 or len(labels) == len(children)
-                    alt_id = graph.add_node(AlternationNode(idx=alt_idx[rule.name], conditions=append_unique(graph.alt_conds, conditions) if all(isfloat(cond) for cond in conditions) else conditions, rule_id=rule.id))
-                    alt_idx[rule.name] += 1
-                    graph.add_edge(frm=parent_id, to=alt_id)
-
-                    for i, child in enumerate(children):
-                        alternative_id = graph.add_node(AlternativeNode(rule_id=rule.id, alt_idx=graph.vertices[alt_id].idx, idx=i))
-                        graph.add_edge(frm=alt_id, to=alternative_id)
-
-                        if labels:
-                            # Add label index to rules to distinguish the alternatives with recurring labels.
-                            label_idx = labels[:i + 1].count(labels[i]) - 1 if labels[i] in recurring_labels else None
-                            rule_node_id = graph.add_node(UnparserRuleNode(name=(rule.name, labels[i], label_idx) if label_idx is not None else (rule.name, labels[i])))
-                            graph.add_edge(frm=alternative_id, to=rule_node_id)
-                            build_rule(graph.vertices[rule_node_id], child)
-                        else:
-                            build_expr(child, alternative_id)
-
-                    # Add an artificial rule named `{rule.name}_{label}` that has a single alternation with
-                    # the original number of alternatives which are however masked to enable to choose only
-                    # those labeled with `label`. This method will be used to regenerate the subtrees produced
-                    # by a labelled alternative with recurring label name.
-                    for label in recurring_labels:
-                        # Mask conditions to enable only the alternatives with the common label.
-                        new_conditions = [cond if labels[ci] == label else '0' for ci, cond in enumerate(conditions)]
-                        recurring_rule_id = graph.add_node(UnparserRuleNode(name=(rule.name, label), trampoline=True))
-                        labeled_alt_id = graph.add_node(AlternationNode(idx=0,
-                                                                        conditions=append_unique(graph.alt_conds, new_conditions) if all(isfloat(cond) for cond in new_conditions) else new_conditions,
-                                                                        rule_id=recurring_rule_id))
-                        graph.add_edge(frm=recurring_rule_id, to=labeled_alt_id)
-                        recurring_idx = 0
-                        for i in range(len(children)):
-                            labeled_alternative_id = graph.add_node(AlternativeNode(rule_id=recurring_rule_id, alt_idx=0, idx=i))
-                            graph.add_edge(frm=labeled_alt_id, to=labeled_alternative_id)
-                            if labels[i] == label:
-                                graph.add_edge(frm=labeled_alternative_id, to=(rule.name, label, recurring_idx))
-                                recurring_idx += 1
-                            else:
-                                graph.add_edge(frm=labeled_alternative_id, to=lambda_id)
-
-                elif isinstance(node, (ANTLRv4Parser.AlternativeContext, ANTLRv4Parser.LexerAltContext)):
-                    children = node.element() if isinstance(node, ANTLRv4Parser.AlternativeContext) else node.lexerElements().lexerElement()
-                    for child in children:
-                        build_expr(child, parent_id)
-
-                    if not graph.vertices[parent_id].out_neighbours:
-                        graph.add_edge(frm=parent_id, to=lambda_id)
-
-                elif isinstance(node, (ANTLRv4Parser.ElementContext, ANTLRv4Parser.LexerElementContext)):
-                    if node.actionBlock():
-                        # Conditions are handled at alternative processing.
-                        if not actions or node.QUESTION():
-                            return
-
-                        graph.add_edge(frm=parent_id, to=graph.add_node(ActionNode(src=''.join(str(child) for child in node.actionBlock().ACTION_CONTENT()))))
-                        return
-
-                    suffix = None
-                    if node.ebnfSuffix():
-                        suffix = node.ebnfSuffix()
-                    elif hasattr(node, 'ebnf') and node.ebnf() and node.ebnf().blockSuffix():
-                        suffix = node.ebnf().blockSuffix().ebnfSuffix()
-
-                    if not suffix:
-                        build_expr(node.children[0], parent_id)
-                        return
-
-                    suffix = str(suffix.children[0])
-                    quant_ranges = {'?': {'start': 0, 'stop': 1}, '*': {'start': 0, 'stop': 'inf'}, '+': {'start': 1, 'stop': 'inf'}}
-                    quant_id = graph.add_node(QuantifierNode(rule_id=rule.id, idx=quant_idx[rule.name], **quant_ranges[suffix]))
-                    quant_idx[rule.name] += 1
-                    graph.add_edge(frm=parent_id, to=quant_id)
-                    build_expr(node.children[0], quant_id)
-
-                elif isinstance(node, ANTLRv4Parser.LabeledElementContext):
-                    build_expr(node.atom() or node.block(), parent_id)
-                    # Do not save variables if actions are not allowed.
-                    if not actions:
-                        return
-
-                    ident = node.identifier()
-                    name = str(ident.RULE_REF() or ident.TOKEN_REF())
-                    is_list = node.PLUS_ASSIGN() is not None
-                    graph.add_edge(frm=parent_id, to=graph.add_node(VariableNode(name=name, is_list=is_list)))
-                    rule.labels[name] = is_list
-
-                elif isinstance(node, ANTLRv4Parser.RulerefContext):
-                    graph.add_edge(frm=parent_id, to=str(node.RULE_REF()), args=parse_arg_action_block(node, 'call') if actions else None)
-
-                elif isinstance(node, (ANTLRv4Parser.LexerAtomContext, ANTLRv4Parser.AtomContext)):
-                    if node.DOT():
-                        if isinstance(node, ANTLRv4Parser.LexerAtomContext):
-                            graph.add_edge(frm=parent_id, to=graph.add_node(CharsetNode(rule_id=rule.id, idx=chr_idx[rule.name], charset=dot_charset)))
-                            chr_idx[rule.name] += 1
-                        else:
-                            if '_dot' not in graph.vertices:
-                                # Create an artificial `_dot` rule with an alternation of all the lexer rules.
-                                parser_dot_id = graph.add_node(UnparserRuleNode(name='_dot'))
-                                unlexer_ids = [v.name for vid, v in graph.vertices.items() if isinstance(v, UnlexerRuleNode)]
-                                alt_id = graph.add_node(AlternationNode(rule_id=parser_dot_id, idx=0, conditions=[1] * len(unlexer_ids)))
-                                graph.add_edge(frm=parser_dot_id, to=alt_id)
-                                for i, lexer_id in enumerate(unlexer_ids):
-                                    alternative_id = graph.add_node(AlternativeNode(rule_id=parser_dot_id, alt_idx=0, idx=i))
-                                    graph.add_edge(frm=alt_id, to=alternative_id)
-                                    graph.add_edge(frm=alternative_id, to=lexer_id)
-                            graph.add_edge(frm=parent_id, to='_dot')
-
-                    elif node.notSet():
-                        if node.notSet().setElement():
-                            not_ranges = chars_from_set(node.notSet().setElement())
-                        else:
-                            not_ranges = []
-                            for set_element in node.notSet().blockSet().setElement():
-                                not_ranges.extend(chars_from_set(set_element))
-
-                        charset = unique_charset(multirange_diff(graph.charsets[dot_charset], sorted(not_ranges, key=lambda x: x[0])))
-                        graph.add_edge(frm=parent_id, to=graph.add_node(CharsetNode(rule_id=rule.id, idx=chr_idx[rule.name], charset=charset)))
-                        chr_idx[rule.name] += 1
-
-                    elif isinstance(node, ANTLRv4Parser.LexerAtomContext) and node.characterRange():
-                        start, end = character_range_interval(node)
-                        if lexer_rule:
-                            rule.start_ranges.append((start, end))
-
-                        charset = unique_charset([(start, end)])
-                        graph.add_edge(frm=parent_id, to=graph.add_node(CharsetNode(rule_id=rule.id, idx=chr_idx[rule.name], charset=charset)))
-                        chr_idx[rule.name] += 1
-
-                    elif isinstance(node, ANTLRv4Parser.LexerAtomContext) and node.LEXER_CHAR_SET():
-                        ranges = lexer_charset_interval(str(node.LEXER_CHAR_SET())[1:-1])
-                        if lexer_rule:
-                            rule.start_ranges.extend(ranges)
-
-                        charset = unique_charset(sorted(ranges, key=lambda x: x[0]))
-                        graph.add_edge(frm=parent_id, to=graph.add_node(CharsetNode(rule_id=rule.id, idx=chr_idx[rule.name], charset=charset)))
-                        chr_idx[rule.name] += 1
-
-                    for child in node.children:
-                        build_expr(child, parent_id)
-
-                elif isinstance(node, ANTLRv4Parser.TerminalContext):
-                    if node.TOKEN_REF():
-                        if str(node.TOKEN_REF()) != 'EOF':
-                            graph.add_edge(frm=parent_id, to=str(node.TOKEN_REF()))
-
-                    elif node.STRING_LITERAL():
-                        src = unescape_string(str(node.STRING_LITERAL())[1:-1])
-
-                        if lexer_rule:
-                            rule.start_ranges.append((ord(src[0]), ord(src[0]) + 1))
-                            graph.add_edge(frm=parent_id, to=graph.add_node(LiteralNode(src=src)))
-                        else:
-                            # Ensure that every inline literal in parser rules has its lexer rule
-                            # found or implicitly created.
-                            lit_id = literal_lookup.get(src)
-                            if not lit_id:
-                                lit_id = graph.add_node(UnlexerRuleNode())
-                                literal_lookup[src] = lit_id
-                                graph.add_edge(frm=lit_id, to=graph.add_node(LiteralNode(src=src)))
-                            graph.add_edge(frm=parent_id, to=lit_id)
-
-                elif isinstance(node, ParserRuleContext) and node.getChildCount():
-                    for child in node.children:
-                        build_expr(child, parent_id)
+            if node.DOT():
+                if lexer_atom:
+                    graph.add_edge(frm=parent_id, to=graph.add_node(CharsetNode(rule_id=rule.id, idx=chr_idx[rule.name], charset=dot_charset)))
+                    chr_idx[rule.name] += 1
+                else:
+                    if '_dot' not in graph.vertices:
+                        # Create an artificial `_dot` rule with an alternation of all the lexer rules.
+                        parser_dot_id = graph.add_node(UnparserRuleNode(name='_dot'))
+                        unlexer_ids = [v.name for vid, v in graph.vertices.items() if isinstance(v, UnlexerRuleNode)]
+                        alt_id = graph.add_node(AlternationNode(rule_id=parser_dot_id, idx=0, conditions=[1] * len(unlexer_ids)))
+                        graph.add_edge(frm=parser_dot_id, to=alt_id)
+                        for i, lexer_id in enumerate(unlexer_ids):
+                            alternative_id = graph.add_node(AlternativeNode(rule_id=parser_dot_id, alt_idx=0, idx=i))
+                            graph.add_edge(frm=alt_id, to=alternative_id)
+                            graph.add_edge(frm=alternative_id, to=lexer_id)
+                    graph.add_edge(frm=parent_id, to='_dot')
+
+            elif not_set:
+                set_element = not_set.setElement()
+                if set_element:
+                    not_ranges = chars_from_set(set_element)
+                else:
+                    not_ranges = []
+                    for set_element in not_set.blockSet().setElement():
+                        not_ranges.extend(chars_from_set(set_element))
+
+                charset = unique_charset(multirange_diff(graph.charsets[dot_charset], merge_ranges(not_ranges)))
+                graph.add_edge(frm=parent_id, to=graph.add_node(CharsetNode(rule_id=rule.id, idx=chr_idx[rule.name], charset=charset)))
+                chr_idx[rule.name] += 1
+
+            elif lexer_atom and node.characterRange():
+                start, end = character_range_interval(node)
+                if lexer_rule:
+                    rule.start_ranges.append((start, end))
+
+                charset = unique_charset([(start, end)])
+                graph.add_edge(frm=parent_id, to=graph.add_node(CharsetNode(rule_id=rule.id, idx=chr_idx[rule.name], charset=charset)))
+                chr_idx[rule.name] += 1
+
+            elif lexer_atom and node.LEXER_CHAR_SET():
+                ranges = lexer_charset_interval(str(node.LEXER_CHAR_SET())[1:-1])
+                if lexer_rule:
+                    rule.start_ranges.extend(ranges)
+
+                charset = unique_charset(ranges)
+                graph.add_edge(frm=parent_id, to=graph.add_node(CharsetNode(rule_id=rule.id, idx=chr_idx[rule.name], charset=charset)))
+                chr_idx[rule.name] += 1
+
+            build_children(rule, node, parent_id)
+
+        def build_terminal(rule, node, parent_id):
+            token_ref = node.TOKEN_REF()
+            if token_ref:
+                token_name = str(token_ref)
+                if token_name != 'EOF':
+                    graph.add_edge(frm=parent_id, to=token_name)
+                return
+
+            string_literal = node.STRING_LITERAL()
+            if string_literal:
+                src = unescape_string(str(string_literal)[1:-1])
+
+                if isinstance(rule, UnlexerRuleNode):
+                    rule.start_ranges.append((ord(src[0]), ord(src[0]) + 1))
+                    graph.add_edge(frm=parent_id, to=unique_literal(src))
+                else:
+                    # Ensure that every inline literal in parser rules has its lexer rule
+                    # found or implicitly created.
+                    lit_id = literal_lookup.get(src)
+                    if not lit_id:
+                        lit_id = graph.add_node(UnlexerRuleNode())
+                        literal_lookup[src] = lit_id
+                        graph.add_edge(frm=lit_id, to=unique_literal(src))
+                    graph.add_edge(frm=parent_id, to=lit_id)
+
+        def build_children(rule, node, parent_id):
+            if isinstance(node, ParserRuleContext) and node.getChildCount():
+                for child in node.children:
+                    build_expr(rule, child, parent_id)
+
+        # Handlers of the ANTLR contexts that contribute to the graph, keyed by
+        # the exact context class. Any other node is only traversed.
+        expr_builders = {
+            ANTLRv4Parser.ParserRuleSpecContext: build_parser_rule_spec,
+            ANTLRv4Parser.RuleAltListContext: build_alt_list,
+            ANTLRv4Parser.AltListContext: build_alt_list,
+            ANTLRv4Parser.LexerAltListContext: build_alt_list,
+            ANTLRv4Parser.AlternativeContext: build_alternative,
+            ANTLRv4Parser.LexerAltContext: build_alternative,
+            ANTLRv4Parser.ElementContext: build_element,
+            ANTLRv4Parser.LexerElementContext: build_element,
+            ANTLRv4Parser.LabeledElementContext: build_labeled_element,
+            ANTLRv4Parser.RulerefContext: build_ruleref,
+            ANTLRv4Parser.LexerAtomContext: build_atom,
+            ANTLRv4Parser.AtomContext: build_atom,
+            ANTLRv4Parser.TerminalContext: build_terminal,
+        }
+
+        def build_expr(rule, node, parent_id):
+            expr_builders.get(type(node), build_children)(rule, node, parent_id)
 
+        def build_rule(rule, node):
+            lexer_rule = isinstance(rule, UnlexerRuleNode)
             if lexer_rule:
                 rule.start_ranges = []
 
-            build_expr(node, rule.id)
+            build_expr(rule, node, rule.id)
 
             # Save lexer rules with constant literals to enable resolving them in parser rules.
             if lexer_rule and len(rule.out_edges) == 1 and isinstance(rule.out_edges[0].dst, LiteralNode):
@@ -1087,7 +1314,8 @@ class ProcessorTool:
             assert isinstance(node, ANTLRv4Parser.GrammarSpecContext)
 
             if not graph.name:
-                graph.name = re.sub(r'^(.+?)(Lexer|Parser)?$', r'\1Generator', str(node.grammarDecl().identifier().TOKEN_REF() or node.grammarDecl().identifier().RULE_REF()))
+                grammar_ident = node.grammarDecl().identifier()
+                graph.name = re.sub(r'^(.+?)(Lexer|Parser)?$', r'\1Generator', str(grammar_ident.TOKEN_REF() or grammar_ident.RULE_REF()))
 
             for prequelConstruct in node.prequelConstruct() if node.prequelConstruct() else ():
                 for option in prequelConstruct.optionsSpec().option() if prequelConstruct.optionsSpec() else ():
@@ -1095,9 +1323,11 @@ class ProcessorTool:
                     ident = str(ident.RULE_REF() or ident.TOKEN_REF())
                     graph.options[ident] = option.optionValue().getText()
 
-                for identifier in prequelConstruct.tokensSpec().idList().identifier() if prequelConstruct.tokensSpec() and prequelConstruct.tokensSpec().idList() else ():
-                    assert identifier.TOKEN_REF() is not None, 'Token names must start with uppercase letter.'
-                    graph.add_node(ImagRuleNode(id=str(identifier.TOKEN_REF())))
+                tokens_spec = prequelConstruct.tokensSpec()
+                for identifier in tokens_spec.idList().identifier() if tokens_spec and tokens_spec.idList() else ():
+                    token_ref = identifier.TOKEN_REF()
+                    assert token_ref is not None, 'Token names must start with uppercase letter.'
+                    graph.add_node(ImagRuleNode(id=str(token_ref)))
 
                 if prequelConstruct.action_() and actions:
                     action = prequelConstruct.action_()
@@ -1115,12 +1345,13 @@ class ProcessorTool:
         def build_rules(node):
             generator_rules, duplicate_rules = [], []
             for rule in node.rules().ruleSpec():
-                if rule.parserRuleSpec():
-                    rule_spec = rule.parserRuleSpec()
+                parser_rule_spec, lexer_rule_spec = rule.parserRuleSpec(), rule.lexerRuleSpec()
+                if parser_rule_spec:
+                    rule_spec = parser_rule_spec
                     rule_node = UnparserRuleNode(name=str(rule_spec.RULE_REF()))
                     antlr_node = rule_spec
-                elif rule.lexerRuleSpec():
-                    rule_spec = rule.lexerRuleSpec()
+                elif lexer_rule_spec:
+                    rule_spec = lexer_rule_spec
                     rule_node = UnlexerRuleNode(name=str(rule_spec.TOKEN_REF()))
                     antlr_node = rule_spec.lexerRuleBlock()
                 else:
@@ -1161,15 +1392,22 @@ class ProcessorTool:
                 build_prequel(root)
         graph.options.update(options or {})
 
-        dot_charset = unique_charset(dot_ranges[graph.dot])
+        charset_lookup = {}
+        dot_charset = unique_charset(dot_ranges[graph.dot]())
 
-        literal_lookup = {}
+        literal_nodes, literal_lookup = {}, {}
         alt_idx, quant_idx, chr_idx = Counter(), Counter(), Counter()
 
-        for root in [lexer_root, parser_root]:
-            if root:
-                build_rules(root)
+        try:
+            for root in [lexer_root, parser_root]:
+                if root:
+                    build_rules(root)
+        finally:
+            # The characters matched against unicode properties are not needed
+            # once the rules are built, so do not keep them alive.
+            unicode_chars.cache_clear()
 
+        graph.group_vertices()
         graph.calc_min_sizes()
         graph.find_immutable_rules()
         return graph
@@ -1181,20 +1419,20 @@ class ProcessorTool:
     @staticmethod
     def _analyze_graph(graph, root=None):
         root = root or graph.default_rule
-        min_distances = defaultdict(lambda: inf)
-        min_distances[(root,)] = 0
+        # Only the vertices reachable from the root get a (finite) distance.
+        min_distances = {(root,): 0}
 
-        work_list = [(root,)]
+        work_list = deque([(root,)])
         while work_list:
-            v = work_list.pop(0)
+            v = work_list.popleft()
             for out_v in graph.vertices[v].out_neighbours:
                 d = min_distances[v] + int(isinstance(out_v, RuleNode))
-                if d < min_distances[out_v.id]:
+                if d < min_distances.get(out_v.id, inf):
                     min_distances[out_v.id] = d
                     work_list.append(out_v.id)
 
-        farthest_ident, max_distance = max(((v_id, d) for v_id, d in min_distances.items() if (isinstance(graph.vertices[v_id], RuleNode) and d != inf)), key=lambda item: item[1])
-        unreachable_rules = [v_id for v_id, v in graph.vertices.items() if isinstance(v, RuleNode) and min_distances[v_id] == inf]
+        farthest_ident, max_distance = max(((v_id, d) for v_id, d in min_distances.items() if isinstance(graph.vertices[v_id], RuleNode)), key=lambda item: item[1])
+        unreachable_rules = [v_id for v_id, v in graph.vertices.items() if isinstance(v, RuleNode) and v_id not in min_distances]
 
         logger.info('\tThe farthest rule from %r is %r (%d step(s)).', root, '_'.join(farthest_ident), max_distance)
         if unreachable_rules:
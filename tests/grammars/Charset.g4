@@ -20,7 +20,7 @@
 grammar Charset;
 
 start
-  : SPECIAL_ESCAPE NON_RANGE_DASH UNICODE_ESCAPE RANGE UNICODE_NOTSET CHAR_RANGE USTR
+  : SPECIAL_ESCAPE NON_RANGE_DASH UNICODE_ESCAPE RANGE UNICODE_NOTSET CHAR_RANGE USTR OVERLAPPING_RANGE
   ;
 
 SPECIAL_ESCAPE
@@ -50,3 +50,7 @@ CHAR_RANGE
 USTR
   : '\u{1F600}\u0041\n\u0042'
   ;
+
+OVERLAPPING_RANGE
+  : [a-mf-z0-45-9] [aaa] ~[a-mf-z\u0000-\u0040]
+  ;
@@ -0,0 +1,23 @@
+/*
+ * Copyright (c) 2024 Renata Hodovan, Akos Kiss.
+ *
+ * Licensed under the BSD 3-Clause License
+ * <LICENSE.rst or https://opensource.org/licenses/BSD-3-Clause>.
+ * This file may not be copied, modified, or distributed except
+ * according to those terms.
+ */
+
+/*
+ * This test checks whether cyclic grammar imports are followed only once.
+ */
+
+// TEST-PROCESS: {grammar}.g4 -o {tmpdir} --lib import
+// TEST-GENERATE: {grammar}Generator.{grammar}Generator -r start -j 1 -o {tmpdir}/{grammar}%d.txt
+
+grammar CyclicImporter;
+
+import CyclicFirst;
+
+start
+  : first second
+  ;
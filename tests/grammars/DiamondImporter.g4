@@ -0,0 +1,24 @@
+/*
+ * Copyright (c) 2024 Renata Hodovan, Akos Kiss.
+ *
+ * Licensed under the BSD 3-Clause License
+ * <LICENSE.rst or https://opensource.org/licenses/BSD-3-Clause>.
+ * This file may not be copied, modified, or distributed except
+ * according to those terms.
+ */
+
+/*
+ * This test checks whether a grammar imported by multiple grammars (in a
+ * diamond shape) contributes its rules only once.
+ */
+
+// TEST-PROCESS: {grammar}.g4 -o {tmpdir} --lib import
+// TEST-GENERATE: {grammar}Generator.{grammar}Generator -r start -j 1 -o {tmpdir}/{grammar}%d.txt
+
+grammar DiamondImporter;
+
+import DiamondLeft, DiamondRight;
+
+start
+  : left right
+  ;
@@ -0,0 +1,18 @@
+/*
+ * Copyright (c) 2024 Renata Hodovan, Akos Kiss.
+ *
+ * Licensed under the BSD 3-Clause License
+ * <LICENSE.rst or https://opensource.org/licenses/BSD-3-Clause>.
+ * This file may not be copied, modified, or distributed except
+ * according to those terms.
+ */
+
+/* This grammar is used by ../CyclicImporter.g4 */
+
+grammar CyclicFirst;
+
+import CyclicSecond;
+
+first
+  : 'first'
+  ;